@@ -0,0 +1,98 @@
+import time
+import random
+import asyncio
+import threading
+
+# Dune execution states that end an execution. COMPLETED_PARTIAL means the
+# result was truncated, so callers decide whether partial rows are usable.
+STATE_COMPLETED = 'QUERY_STATE_COMPLETED'
+STATE_COMPLETED_PARTIAL = 'QUERY_STATE_COMPLETED_PARTIAL'
+FAILED_STATES = frozenset({
+    'QUERY_STATE_FAILED',
+    'QUERY_STATE_CANCELLED',
+    'QUERY_STATE_EXPIRED',
+})
+
+def backoff_delay(attempt, base, cap):
+    """Exponential backoff with jitter, capped at cap seconds"""
+    return min(cap, base * 1.5 ** attempt) * random.uniform(0.8, 1.2)
+
+def retry_after_delay(headers, default):
+    """Parse a Retry-After header (seconds), falling back to default"""
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return default
+
+class TokenBucket:
+    """Token bucket for Dune API calls, not safe for concurrent use on its own.
+
+    The rate adapts AIMD-style: halved on every 429, raised by one request
+    per period after each success, up to max_rate. RateLimiter and
+    AsyncRateLimiter add the locking and waiting for threads and coroutines.
+    """
+
+    def __init__(self, max_rate, time_period=1.0, min_rate=1.0):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.time_period = time_period
+        self.rate = max_rate
+        self._tokens = max_rate
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.time_period)
+        self._updated = now
+
+    def _take(self):
+        """Take a token and return 0, or return the seconds until one is available"""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) * self.time_period / self.rate
+
+    def update(self, status):
+        """Adjust the rate from a response status code"""
+        if status == 429:
+            self.rate = max(self.min_rate, self.rate / 2)
+        elif status < 400:
+            self.rate = min(self.max_rate, self.rate + 1)
+
+class RateLimiter(TokenBucket):
+    """Thread-safe token bucket, used as `with LIMITER:` around each request"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            while (delay := self._take()) > 0:
+                time.sleep(delay)
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def update(self, status):
+        with self._lock:
+            super().update(status)
+
+class AsyncRateLimiter(TokenBucket):
+    """Token bucket for coroutines, used as `async with LIMITER:` around each request"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Created on first use, inside the running event loop
+        self._lock = None
+
+    async def __aenter__(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while (delay := self._take()) > 0:
+                await asyncio.sleep(delay)
+
+    async def __aexit__(self, *exc_info):
+        return False
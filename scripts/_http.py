@@ -0,0 +1,46 @@
+import os
+import contextvars
+import aiohttp
+import orjson
+
+# One aiohttp session per event loop, shared by every coroutine that talks to
+# the Dune API so they reuse the same DNS cache and keep-alive connections.
+# Call get_session() in the top-level coroutine before spawning tasks: tasks
+# copy the current context when they are created, so they all see the session.
+_session = contextvars.ContextVar('dune_http_session', default=None)
+
+async def get_session():
+    """Return the shared session, creating it on first use.
+
+    The session carries the Dune API headers, read from DUNE_API_KEY when
+    it is created, so every caller gets the same configuration.
+    """
+    session = _session.get()
+    if session is None or session.closed:
+        api_key = os.getenv('DUNE_API_KEY')
+        if not api_key:
+            raise ValueError("DUNE_API_KEY environment variable is not set")
+        headers = {
+            "X-DUNE-API-KEY": api_key,
+            "Content-Type": "application/json"
+        }
+        connector = aiohttp.TCPConnector(
+            limit=64,
+            limit_per_host=16,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            headers=headers,
+            json_serialize=lambda obj: orjson.dumps(obj).decode(),
+        )
+        _session.set(session)
+    return session
+
+async def close_session():
+    """Close the shared session, if one was created"""
+    session = _session.get()
+    if session is not None:
+        await session.close()
+        _session.set(None)
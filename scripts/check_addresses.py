@@ -1,346 +1,403 @@
 import os
 import csv
 import time
-import json
-import shutil
-import requests
+import string
+import sqlite3
+import asyncio
+import logging
+from contextlib import closing
+import orjson
+from pathlib import Path
 from tqdm import tqdm
 from dotenv import load_dotenv
+import _dune
+from _dune import AsyncRateLimiter, backoff_delay, retry_after_delay
+from _http import get_session, close_session
 from tqdm import tqdm
 
 # Load environment variables
 load_dotenv()
 
+# 日志级别可通过LOGLEVEL环境变量调整，DEBUG时输出SQL和每次请求的响应
+logging.basicConfig(level=os.getenv('LOGLEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(message)s')
+log = logging.getLogger(__name__)
+
 # 从环境变量中获取API密钥
 API_KEY = os.getenv('DUNE_API_KEY')
 if not API_KEY:
     raise ValueError("请设置DUNE_API_KEY环境变量")
 
-# Dune查询ID
-QUERY_ID = 5237195
+# File paths, resolved once relative to the repo root so the script works from any directory
+BASE_DIR = Path(__file__).resolve().parent.parent
+INPUT_CSV = BASE_DIR / 'exchange_usdt_T_address_verified.csv'
+OUTPUT_CSV = BASE_DIR / 'exchange_usdt_T_address_verified_updated.csv'
+
+# 验证结果缓存，按地址保存，跨运行复用
+CACHE_DB = BASE_DIR / 'verify_cache.db'
+CACHE_TTL = 7 * 24 * 3600
 
-# File paths
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-INPUT_CSV = os.path.join(BASE_DIR, 'exchange_usdt_T_address_verified.csv')
-OUTPUT_CSV = os.path.join(BASE_DIR, 'exchange_usdt_T_address_verified_updated.csv')
+# Dune API地址，执行ID在请求时填入
+DUNE_API_BASE_URL = "https://api.dune.com/api/v1"
+SQL_EXECUTE_URL = f"{DUNE_API_BASE_URL}/sql/execute"
+RESULTS_URL = f"{DUNE_API_BASE_URL}/execution/{{execution_id}}/results"
 
 # Field names for the CSV
 fieldnames = ['exchange', 'symbol', 'address', 'address_hex', 'is_verified']
 
-def execute_dune_query(address_hex):
+# 同时执行的Dune查询数量上限
+MAX_CONCURRENCY = 8
+
+# 每次Dune执行验证的地址数量
+BATCH_SIZE = 500
+
+# 轮询退避参数（秒）
+POLL_BASE_DELAY = 2.0
+POLL_MAX_DELAY = 60.0
+POLL_TIMEOUT = 600
+
+# Dune API请求限流，每秒最多10个请求
+LIMITER = AsyncRateLimiter(max_rate=10, time_period=1.0)
+
+def is_hex40(s):
+    """判断是否为40位十六进制字符串（20字节地址），校验在C层完成"""
+    try:
+        return len(s) == 40 and len(bytes.fromhex(s)) == 20
+    except ValueError:
+        return False
+
+def normalize_address_hex(address_hex):
     """
-    使用Dune API执行查询并返回结果
+    校验十六进制地址，返回去掉0x前缀的小写40位十六进制字符串；无效时返回None
     """
-    # 确保地址格式正确
-    # 保存原始地址用于调试
     original_hex = address_hex
     
-    # 打印原始地址信息
-    print(f"\n=== 原始地址信息 ===")
-    print(f"原始地址: {original_hex}")
-    print(f"原始地址长度: {len(original_hex)} 字符")
-    print(f"原始地址是否以0x开头: {original_hex.lower().startswith('0x')}")
+    # 去掉0x前缀（如果存在），只比较前两个字符，不复制整个字符串
+    if original_hex.startswith(('0x', '0X')):
+        address_hex = original_hex[2:]
     
-    # 确保地址格式正确
-    if not original_hex.lower().startswith('0x'):
-        print("警告: 地址没有0x前缀，将自动添加")
-        address_hex = f"0x{original_hex}"
-    else:
-        address_hex = original_hex
+    # 确保地址是40位有效的十六进制
+    if not is_hex40(address_hex):
+        log.warning("无效的十六进制地址，期望40位十六进制字符(不含0x): %s", original_hex)
+        return None
     
-    # 检查地址长度（包括0x）
-    if len(address_hex) != 42:  # 0x + 40位十六进制
-        print(f"错误: 地址长度不正确，期望42个字符(包括0x)，实际为{len(address_hex)}个字符")
-        return False
-    
-    # 确保地址是有效的十六进制
-    hex_part = address_hex[2:]  # 去掉0x
-    if not all(c in '0123456789abcdefABCDEF' for c in hex_part):
-        print(f"错误: 地址包含无效的十六进制字符: {hex_part}")
-        return False
-    
-    # 打印地址处理信息
-    print(f"\n=== 地址处理结果 ===")
-    print(f"最终使用的地址: {address_hex}")
-    print(f"地址长度: {len(address_hex)} 字符")
-    print(f"是否为有效十六进制: {all(c in '0123456789abcdefABCDEFxX' for c in address_hex)}")
-    
-    # 构建SQL查询，直接嵌入地址
-    sql_query = f"""
-    -- 使用直接嵌入的地址进行查询
-    SELECT
-        DATE_TRUNC('day', evt_block_time) AS dt,
-        'USDT' as asset,
-        SUM(
-          CASE 
-            WHEN "to" = from_hex('{address_hex[2:].lower()}') THEN value
-            WHEN "from" = from_hex('{address_hex[2:].lower()}') THEN -value
-          END
-          / 1e6) AS net_inflow
-    FROM tether_tron.Tether_USD_evt_Transfer
-    WHERE contract_address = 0xa614f803b6fd780986a42c78ec9c7f77e6ded13c
-      AND ("to" = from_hex('{address_hex[2:].lower()}')
-        OR "from" = from_hex('{address_hex[2:].lower()}'))
-    GROUP BY 1, 2
-    ORDER BY 1 DESC
-    LIMIT 10;
+    return address_hex.lower()
+
+# 批量验证SQL模板，$values为地址列表
+VERIFY_SQL_TEMPLATE = string.Template("""
+    -- 批量验证地址，每个有转账记录的地址返回一行
+    SELECT t.addr
+    FROM (VALUES $values) AS t(addr)
+    WHERE EXISTS (
+        SELECT 1
+        FROM tether_tron.Tether_USD_evt_Transfer
+        WHERE contract_address = 0xa614f803b6fd780986a42c78ec9c7f77e6ded13c
+          AND ("to" = from_hex(t.addr)
+            OR "from" = from_hex(t.addr))
+    )
+    """)
+
+def build_verify_sql(hex_parts):
     """
+    构建批量验证SQL：一次查询返回所有在USDT转账中出现过的地址
+
+    只需判断是否存在转账，EXISTS找到第一条匹配记录即可停止，无需聚合
+    """
+    values = ", ".join(f"('{hex_part}')" for hex_part in hex_parts)
+    return VERIFY_SQL_TEMPLATE.substitute(values=values)
+
+async def poll_until_done(session, execution_id, deadline):
+    """
+    轮询结果端点直到执行结束，返回完成时的结果；失败、取消或超时返回None
+
+    执行完成时同一个响应里就带有结果，无需单独查询状态。
+    带抖动的指数退避，以deadline（time.monotonic()时间）为上限
+    """
+    results_url = RESULTS_URL.format(execution_id=execution_id)
+    attempt = 0
+    wait_time = backoff_delay(attempt, POLL_BASE_DELAY, POLL_MAX_DELAY)
+    while time.monotonic() + wait_time <= deadline:
+        log.debug("%s: %.1f秒后获取结果 (尝试 %d)", execution_id, wait_time, attempt + 1)
+        await asyncio.sleep(wait_time)
+        attempt += 1
+        wait_time = backoff_delay(attempt, POLL_BASE_DELAY, POLL_MAX_DELAY)
+        
+        async with LIMITER, session.get(results_url) as results_response:
+            LIMITER.update(results_response.status)
+            
+            if results_response.status == 429:
+                # 被限流时优先使用服务端给出的Retry-After
+                wait_time = retry_after_delay(results_response.headers, wait_time)
+                log.info("请求被限流，%.1f秒后重试", wait_time)
+                continue
+            
+            if results_response.status != 200:
+                log.error("获取结果失败: %s, 错误信息: %s", results_response.status, await results_response.text())
+                return None
+            
+            results = orjson.loads(await results_response.read())
+        
+        state = results.get('state')
+        log.debug("%s 当前状态: %s", execution_id, state)
+        
+        match state:
+            case _dune.STATE_COMPLETED:
+                return results
+            case _dune.STATE_COMPLETED_PARTIAL:
+                # 部分结果无法区分未返回的地址是否有转账，整批按失败处理
+                log.error("查询执行 %s 只返回了部分结果，无法确认全部地址", execution_id)
+                return None
+            case _ if state in _dune.FAILED_STATES:
+                log.error("查询执行 %s 失败，状态: %s, 错误详情: %s", execution_id, state, results.get('error', '未知错误'))
+                return None
+            case _:
+                # 仍在排队或执行中，退避后继续轮询
+                continue
     
-    # 准备请求体 - 使用原始SQL查询
-    params = {
-        "query_sql": sql_query,
-        "parameters": []
-    }
-    
-    # 使用API v2的原始SQL执行端点
-    DUNE_API_BASE_URL = "https://api.dune.com/api/v2"
+    log.error("查询 %s 在截止时间前仍未完成", execution_id)
+    return None
+
+async def execute_dune_query(session, hex_parts):
+    """
+    使用Dune API异步执行批量验证查询，返回已验证地址的集合；失败时返回None
+    """
+    sql_query = build_verify_sql(hex_parts)
     
-    # 打印SQL查询用于调试
-    print("\n" + "="*50)
-    print("SQL查询:")
-    print(sql_query)
-    print("="*50)
+    log.debug("SQL查询:\n%s", sql_query)
     
     try:
-        # 使用Dune API v1的参数格式
+        # 使用原始SQL执行端点，地址列表直接嵌入SQL
         params = {
-            "parameters": [
-                {
-                    "key": "address_hex",
-                    "type": "text",
-                    "value": original_hex  # 使用原始地址
-                }
-            ]
+            "sql": sql_query,
+            "performance": "medium"
         }
         
         # 执行查询
-        DUNE_API_BASE_URL = "https://api.dune.com/api/v1"
-        url = f"{DUNE_API_BASE_URL}/query/{QUERY_ID}/execute"
-        headers = {
-            "X-Dune-API-Key": API_KEY,
-            "Content-Type": "application/json"
-        }
-        
-        # 添加调试信息
-        print("\n" + "="*50)
-        print("执行查询...")
-        print(f"URL: {url}")
-        print(f"Headers: {json.dumps(headers, indent=2)}")
-        print(f"Params: {json.dumps(params, indent=2)}")
-        print("="*50)
-        
-        print(f"\n=== 正在执行查询 ===")
-        print(f"地址: {address_hex}")
-        print(f"请求URL: {url}")
-        print(f"请求参数: {params}")
+        log.debug("正在执行查询: %s, 地址数量: %d", SQL_EXECUTE_URL, len(hex_parts))
         
-        response = requests.post(url, headers=headers, json=params)
-        
-        print("\n=== 收到响应 ===")
-        print(f"状态码: {response.status_code}")
-        print(f"响应内容: {response.text}")
-        
-        if response.status_code != 200:
-            print(f"查询执行失败，状态码: {response.status_code}")
-            print(f"错误信息: {response.text}")
-            return False
+        # 提交和轮询共用同一个截止时间
+        deadline = time.monotonic() + POLL_TIMEOUT
+        attempt = 0
+        while True:
+            async with LIMITER, session.post(SQL_EXECUTE_URL, json=params) as response:
+                LIMITER.update(response.status)
+                response_text = await response.text()
+                
+                log.debug("收到响应: %s - %s", response.status, response_text)
+                
+                if response.status == 429:
+                    # 被限流的提交不会启动执行，可以安全重试
+                    wait_time = backoff_delay(attempt, POLL_BASE_DELAY, POLL_MAX_DELAY)
+                    wait_time = retry_after_delay(response.headers, wait_time)
+                    attempt += 1
+                else:
+                    if response.status != 200:
+                        log.error("查询执行失败，状态码: %s, 错误信息: %s", response.status, response_text)
+                        return None
+                    result = orjson.loads(response_text)
+                    break
             
-        result = response.json()
+            if time.monotonic() + wait_time > deadline:
+                log.error("提交查询被限流，截止时间前无法重试")
+                return None
+            log.info("提交查询被限流，%.1f秒后重试", wait_time)
+            await asyncio.sleep(wait_time)
         execution_id = result.get('execution_id')
         state = result.get('state')
         
-        if not execution_id or state == 'QUERY_STATE_FAILED':
-            print(f"查询执行失败: {result.get('error', '未知错误')}")
-            return False
+        if not execution_id or state in _dune.FAILED_STATES:
+            log.error("查询执行失败: %s", result.get('error', '未知错误'))
+            return None
             
-        print(f"查询已提交，执行ID: {execution_id}")
+        log.info("查询已提交，执行ID: %s", execution_id)
+        
+        results = await poll_until_done(session, execution_id, deadline)
+        if results is None:
+            return None
+        
+        result_rows = results.get('result', {}).get('rows', [])
+        log.info("查询成功，%d 个地址中有 %d 个有交易记录", len(hex_parts), len(result_rows))
+        return {row['addr'] for row in result_rows}
+        
+    except Exception as e:
+        log.error("Error executing Dune query: %s", e)
+        return None
+
+
+def open_cache(path=CACHE_DB):
+    """打开验证结果缓存数据库，必要时建表"""
+    cache = sqlite3.connect(path)
+    cache.execute("CREATE TABLE IF NOT EXISTS verify(addr TEXT PRIMARY KEY, is_verified TEXT, ts INTEGER)")
+    return cache
+
+def load_cached(cache, hex_parts):
+    """
+    读取缓存的验证结果，返回{hex_part: is_verified}
+
+    'yes'结果长期有效；'no'结果超过CACHE_TTL秒后重新查询
+    """
+    hex_parts = list(hex_parts)
+    min_ts = int(time.time()) - CACHE_TTL
+    cached = {}
+    # 分块查询，避免超出SQLite的参数个数限制
+    for i in range(0, len(hex_parts), 500):
+        chunk = hex_parts[i:i + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        cached.update(cache.execute(
+            f"SELECT addr, is_verified FROM verify "
+            f"WHERE addr IN ({placeholders}) AND (is_verified = 'yes' OR ts >= ?)",
+            [*chunk, min_ts],
+        ))
+    return cached
+
+def save_cached(cache, results):
+    """写入新的验证结果，error结果不缓存"""
+    now = int(time.time())
+    with cache:
+        cache.executemany(
+            "INSERT OR REPLACE INTO verify(addr, is_verified, ts) VALUES (?, ?, ?)",
+            [(hex_part, status, now) for hex_part, status in results.items() if status != 'error'],
+        )
+
+async def process_batch(session, hex_parts):
+    """批量验证一组地址，返回{hex_part: 'yes'/'no'/'error'}"""
+    log.info("开始批量验证 %d 个十六进制地址", len(hex_parts))
+    
+    try:
+        verified = await execute_dune_query(session, hex_parts)
+    except Exception:
+        log.exception("批量验证 %d 个地址时出错", len(hex_parts))
+        verified = None
+    
+    log.info("批量验证完成: %d 个地址", len(hex_parts))
+    if verified is None:
+        return {hex_part: 'error' for hex_part in hex_parts}
+    return {hex_part: 'yes' if hex_part in verified else 'no' for hex_part in hex_parts}
+
+async def process_csv():
+    """流式处理CSV文件并并发更新is_verified字段"""
+    with open(INPUT_CSV, 'r', encoding='utf-8', newline='') as f_in:
+        # 逐行读取，行保存为列表，按列下标访问
+        reader = csv.reader(f_in)
+        header = next(reader, None)
+        if header is None:
+            log.error("CSV文件为空")
+            return
+        
+        # 输入没有is_verified列时追加该列，读取时每行补齐到表头长度
+        if 'is_verified' not in header:
+            header.append('is_verified')
+        addr_idx = header.index('address_hex')
+        verified_idx = header.index('is_verified')
         
-        # 轮询查询状态
-        max_attempts = 30
-        for attempt in range(1, max_attempts + 1):
-            wait_time = min(2 ** attempt, 60)  # 指数退避，最大60秒
-            print(f"Checking status in {wait_time} seconds... (attempt {attempt}/{max_attempts})")
-            time.sleep(wait_time)
+        # 输出文件只打开一次，每得到一批结果就追加写入；
+        # 连接自身的with只提交或回滚事务，出错时也要靠closing关闭连接
+        with closing(open_cache()) as cache, cache, open(OUTPUT_CSV, 'w', newline='', encoding='utf-8') as f_out:
+            writer = csv.writer(f_out)
+            writer.writerow(header)
             
-            status_url = f"https://api.dune.com/api/v1/execution/{execution_id}/status"
-            print(f"\n检查执行状态 (尝试 {attempt}/{max_attempts})")
-            print(f"状态URL: {status_url}")
+            # 有界队列提供背压：查询或写入跟不上时暂停读取，内存占用与并发数成正比而非与行数成正比
+            work_queue = asyncio.Queue(maxsize=2 * MAX_CONCURRENCY)
+            out_queue = asyncio.Queue(maxsize=2 * MAX_CONCURRENCY)
             
-            status_response = requests.get(status_url, headers=headers)
-            print(f"状态响应: {status_response.status_code} - {status_response.text}")
+            # 跨批次去重：pending为已提交但尚无结果的地址及等待该结果的行，
+            # resolved为本次运行已得到的结果，后续重复地址直接复用，不再查询
+            pending = {}
+            resolved = {}
             
-            if status_response.status_code != 200:
-                print(f"获取状态失败: {status_response.status_code}")
-                print(f"错误信息: {status_response.text}")
-                return False
-                
-            status_data = status_response.json()
-            print(f"状态数据: {status_data}")
+            def resolve(results):
+                """记录一组地址的结果，返回所有等待这些地址的行"""
+                rows = []
+                for hex_part, status in results.items():
+                    resolved[hex_part] = status
+                    for row in pending.pop(hex_part):
+                        row[verified_idx] = status
+                        rows.append(row)
+                return rows
             
-            state = status_data.get('state')
-            print(f"当前状态: {state}")
+            async def enqueue_batch(hex_parts):
+                """先使用缓存结果，未命中的地址作为一批放入查询队列，返回缓存命中数"""
+                cached = load_cached(cache, hex_parts)
+                if cached:
+                    await out_queue.put(resolve(cached))
+                misses = [hex_part for hex_part in hex_parts if hex_part not in cached]
+                if misses:
+                    await work_queue.put(misses)
+                return len(cached)
             
-            if state == 'QUERY_STATE_COMPLETED':
-                # 获取查询结果
-                results_url = f"https://api.dune.com/api/v1/execution/{execution_id}/results"
-                results_response = requests.get(results_url, headers=headers)
-                
-                if results_response.status_code == 200:
-                    results = results_response.json()
-                    result_rows = results.get('result', {}).get('rows', [])
-                    has_results = bool(result_rows)
-                    print(f"查询成功，找到 {len(result_rows)} 条记录")
-                    return has_results
-                else:
-                    print(f"获取结果失败: {results_response.status_code}")
-                    print(f"错误信息: {results_response.text}")
-                    return False
-                    
-            elif state in ['QUERY_STATE_FAILED', 'QUERY_STATE_CANCELED']:
-                print(f"Execution {execution_id} 状态: {state}")
-                print(f"完整状态响应: {status_data}")
-                
-                # 尝试获取更详细的错误信息
-                error_url = f"https://api.dune.com/api/v1/execution/{execution_id}/results"
-                error_response = requests.get(error_url, headers=headers)
-                
-                print(f"\n查询执行 {execution_id} 失败")
-                print(f"错误信息: 未知错误")
-                print(f"错误详情响应状态: {error_response.status_code}")
-                print(f"错误详情: {error_response.text}")
-                
-                return False
+            async def producer():
+                """逐行读取CSV，校验地址并按地址去重，每BATCH_SIZE个新地址为一批"""
+                n_rows = n_cached = 0
+                batch = []
+                for row in reader:
+                    # 跳过空行；列数不足的行补空值，缺少地址时按无效地址处理
+                    if not row:
+                        continue
+                    n_rows += 1
+                    if len(row) < len(header):
+                        row.extend([''] * (len(header) - len(row)))
+                    hex_part = normalize_address_hex(row[addr_idx].strip())
+                    if hex_part is None:
+                        # 无效地址直接标记为error并写入
+                        row[verified_idx] = 'error'
+                        await out_queue.put([row])
+                        continue
+                    if hex_part in resolved:
+                        row[verified_idx] = resolved[hex_part]
+                        await out_queue.put([row])
+                    elif hex_part in pending:
+                        # 该地址已在查询中，等待同一个结果
+                        pending[hex_part].append(row)
+                    else:
+                        pending[hex_part] = [row]
+                        batch.append(hex_part)
+                        if len(batch) >= BATCH_SIZE:
+                            n_cached += await enqueue_batch(batch)
+                            batch = []
+                if batch:
+                    n_cached += await enqueue_batch(batch)
                 
-            print(f"查询仍在执行，{wait_time}秒后再次检查...")
+                # 每个worker一个结束标记
+                for _ in range(MAX_CONCURRENCY):
+                    await work_queue.put(None)
+                log.info("成功读取 %d 条记录，缓存命中 %d 个地址", n_rows, n_cached)
             
-            results_response = requests.get(results_url, headers=headers)
-            print(f"结果响应: {results_response.status_code}")
+            async def worker(session):
+                """从查询队列取出一批地址执行Dune查询，结果放入写出队列"""
+                while (hex_parts := await work_queue.get()) is not None:
+                    results = await process_batch(session, hex_parts)
+                    save_cached(cache, results)
+                    await out_queue.put(resolve(results))
             
-            results_response.raise_for_status()
-            results = results_response.json()
-            print(f"完整结果: {results}")
+            async def write_rows():
+                """按完成顺序写入结果行"""
+                while (rows := await out_queue.get()) is not None:
+                    writer.writerows(rows)
+                    f_out.flush()
             
-            result_rows = results.get('result', {}).get('rows', [])
-            has_results = bool(result_rows)
-            print(f"找到结果: {has_results}, 结果行数: {len(result_rows)}")
+            # 所有请求共用全局会话的连接池和Dune请求头，并发数由worker数量限制
+            session = await get_session()
+            readers = [asyncio.create_task(producer())]
+            readers += [asyncio.create_task(worker(session)) for _ in range(MAX_CONCURRENCY)]
             
-            if has_results:
-                print(f"结果示例: {result_rows[0]}")
-            
-            return has_results
-        
-    except Exception as e:
-        print(f"Error executing Dune query: {e}")
-        return False
-
-def process_csv():
-    """处理CSV文件并更新is_verified字段"""
-    input_file = 'exchange_usdt_T_address_verified.csv'
-    output_file = 'exchange_usdt_T_address_verified_updated.csv'
-    
-    # 读取CSV文件
-    with open(input_file, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        fieldnames = reader.fieldnames
-        rows = list(reader)
-        
-    print(f"成功读取 {len(rows)} 条记录")
-    
-    # 创建输出文件的副本，如果不存在
-    if not os.path.exists(output_file):
-        with open(output_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(rows)
-    
-    # 只处理第一行
-    if not rows:
-        print("错误: CSV文件为空")
-        return
-        
-    row = rows[0]  # 只处理第一行
-    print("\n" + "="*50)
-    print("=== 开始处理第一个地址 ===")
-    
-    # 获取地址的十六进制形式
-    address_hex = row.get('address_hex', '').strip()
-    if not address_hex:
-        print("错误: 第一个地址为空")
-        return
-        
-    # 打印当前行信息
-    print(f"\n=== 当前处理行 ===")
-    for key, value in row.items():
-        print(f"{key}: {value}")
-    
-    
-    original_hex = address_hex
-    address_hex = address_hex.strip()
-    
-    # 确保地址是有效的十六进制
-    try:
-        # 移除0x前缀（如果存在）
-        if address_hex.lower().startswith('0x'):
-            address_hex = address_hex[2:]
-        
-        # 验证十六进制格式和长度（不区分大小写）
-        if not all(c in '0123456789abcdefABCDEF' for c in address_hex):
-            print(f"!!! 错误: 无效的十六进制地址: {original_hex} - 包含非十六进制字符")
-            return
-        if len(address_hex) != 40:
-            raise ValueError(f"地址长度必须为40个字符，当前为{len(address_hex)}个字符")
-    except Exception as e:
-        error_msg = f"无效的十六进制地址: {original_hex} - {str(e)}"
-        print(f"\n!!! 错误: {error_msg}")
-        row['is_verified'] = 'error'
-        # 更新输出文件
-        with open(output_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows([row])  # 只写入当前行
-        return
-        
-    print(f"\n=== 地址处理 ===")
-    print(f"原始十六进制: {original_hex}")
-    print(f"处理后的十六进制: {address_hex}")
-    print(f"长度: {len(address_hex)} 字符")
-    
-    # 执行Dune查询
-    print("\n" + "="*50)
-    print(f"开始处理十六进制地址: {original_hex}")
-    print("="*50 + "\n")
-    
-    try:
-        has_results = execute_dune_query(original_hex)
-        
-        print("\n" + "="*50)
-        print(f"十六进制地址 {original_hex} 验证完成")
-        print(f"交易记录: {'有' if has_results else '无'}")
-        print("="*50 + "\n")
-        
-        # 更新验证状态
-        row['is_verified'] = 'yes' if has_results else 'no'
-        
-        # 更新输出文件
-        with open(output_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows([row])  # 只写入当前行
+            async def close_out_queue():
+                """读取和查询全部结束后通知写入任务退出"""
+                await asyncio.wait(readers)
+                await out_queue.put(None)
             
-    except Exception as e:
-        import traceback
-        print(f"\n{'!'*50}")
-        print(f"处理十六进制地址 {address_hex} 时出错:")
-        traceback.print_exc()
-        print("!"*50 + "\n")
-        row['is_verified'] = 'error'
-        # 更新输出文件
-        with open(output_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows([row])  # 只写入当前行
+            tasks = [*readers, asyncio.create_task(close_out_queue()), asyncio.create_task(write_rows())]
+            try:
+                # 任一任务出错（如磁盘已满导致写入失败）都停止整个流水线，
+                # 否则队列无人消费，其余任务会永远阻塞在put上
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    task.result()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await close_session()
     
-    print("\n处理完成！")
+    log.info("处理完成！")
 
 if __name__ == "__main__":
-    process_csv()
+    asyncio.run(process_csv())
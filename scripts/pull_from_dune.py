@@ -1,17 +1,32 @@
 import os
+import gzip
 import yaml
-import json
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import ResponseError
 from dotenv import load_dotenv
 import sys
 import codecs
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from _dune import (
+    STATE_COMPLETED, STATE_COMPLETED_PARTIAL, FAILED_STATES,
+    RateLimiter, backoff_delay, retry_after_delay,
+)
 
 # Set the default encoding to UTF-8
 sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
 
+# Repo paths, resolved once at import
+BASE_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = BASE_DIR / 'results'
+
 # Load environment variables
-dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
+dotenv_path = BASE_DIR / '.env'
 load_dotenv(dotenv_path)
 
 # Get API key from environment
@@ -21,7 +36,7 @@ if not API_KEY:
     sys.exit(1)
 
 # Read the queries.yml file
-queries_yml = os.path.join(os.path.dirname(__file__), '..', 'queries.yml')
+queries_yml = BASE_DIR / 'queries.yml'
 with open(queries_yml, 'r', encoding='utf-8') as file:
     data = yaml.safe_load(file)
 
@@ -30,99 +45,151 @@ query_ids = [str(id) for id in data['query_ids']]  # Ensure IDs are strings
 
 # API configuration
 BASE_URL = "https://api.dune.com/api/v1"
+EXECUTE_URL = f"{BASE_URL}/query/{{query_id}}/execute"
+RESULTS_URL = f"{BASE_URL}/execution/{{execution_id}}/results"
 HEADERS = {
-    "x-dune-api-key": API_KEY,
+    "X-DUNE-API-KEY": API_KEY,
     "Content-Type": "application/json"
 }
+MAX_RETRIES = 5
 
-def get_execution_status(execution_id):
-    """Get the status of a query execution"""
-    url = f"https://api.dune.com/api/v1/execution/{execution_id}/status"
-    headers = {
-        "X-DUNE-API-KEY": API_KEY,
-        "Content-Type": "application/json"
-    }
-    
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        error_msg = f"Error getting status for execution {execution_id}: {e}"
-        if hasattr(e, 'response') and e.response is not None:
-            error_msg += f" - {e.response.status_code} - {e.response.text}"
-        print(error_msg)
-        return {"error": error_msg}
+# Queries are processed in parallel threads; running executions are capped
+# separately to stay under the Dune plan's concurrent execution limit, so the
+# extra workers save finished results while other executions are running
+MAX_WORKERS = 8
+MAX_RUNNING_EXECUTIONS = 3
+EXECUTION_SLOTS = threading.BoundedSemaphore(MAX_RUNNING_EXECUTIONS)
+
+# Status polling backoff (seconds)
+POLL_BASE_DELAY = 1.0
+POLL_MAX_DELAY = 30.0
+POLL_TIMEOUT = 600
+
+# Shared session so every call reuses pooled connections to api.dune.com.
+# Rate limits (429) and transient server errors on GET are retried by urllib3,
+# honouring the Retry-After header. POST is left out of allowed_methods: a 5xx
+# on execute may still have started a (billed) execution, so resubmitting it
+# is unsafe. execute_query retries 429s itself, since those are never run.
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=MAX_RETRIES,
+        backoff_factor=2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+    ),
+))
+
+# At most 10 Dune API requests per second across the whole script
+LIMITER = RateLimiter(max_rate=10, time_period=1.0)
+
+def dune_request(method, url, **kwargs):
+    """Send a rate-limited request through SESSION.
+
+    429s retried inside urllib3 never reach the caller, so they are read
+    back from the retry history to slow the limiter down.
+    """
+    with LIMITER:
+        try:
+            response = SESSION.request(method, url, **kwargs)
+        except requests.exceptions.RetryError as e:
+            # Retries also run out on 5xx; only slow down if the last failure was a 429
+            reason = getattr(e.args[0], 'reason', None) if e.args else None
+            if ResponseError.SPECIFIC_ERROR.format(status_code=429) in str(reason):
+                LIMITER.update(429)
+            raise
+
+    retries = getattr(response.raw, 'retries', None)
+    if retries is not None and any(h.status == 429 for h in retries.history):
+        LIMITER.update(429)
+    else:
+        LIMITER.update(response.status_code)
+    return response
 
 def execute_query(query_id):
     """Execute a query and return the execution ID"""
-    url = f"https://api.dune.com/api/v1/query/{query_id}/execute"
-    headers = {
-        "X-DUNE-API-KEY": API_KEY,
-        "Content-Type": "application/json"
-    }
-    
+    url = EXECUTE_URL.format(query_id=query_id)
     try:
         print(f"Executing query ID: {query_id}")
-        response = requests.post(
-            url, 
-            headers=headers, 
-            json={"performance": "medium"}
-        )
+        for attempt in range(MAX_RETRIES + 1):
+            response = dune_request("POST", url, json={"performance": "medium"})
+            if response.status_code != 429 or attempt == MAX_RETRIES:
+                break
+            wait_time = backoff_delay(attempt, POLL_BASE_DELAY, POLL_MAX_DELAY)
+            wait_time = retry_after_delay(response.headers, wait_time)
+            print(f"Rate limited executing query {query_id}, retrying in {wait_time:.1f}s")
+            time.sleep(wait_time)
         response.raise_for_status()
-        result = response.json()
+        result = orjson.loads(response.content)
         print(f"Execution started: {result}")
         return result
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         error_msg = f"Error executing query {query_id}: {e}"
         if hasattr(e, 'response') and e.response is not None:
             error_msg += f" - {e.response.status_code} - {e.response.text}"
         print(error_msg)
         return {"error": error_msg}
 
-def wait_for_completion(execution_id, max_attempts=30, delay=5):
-    """Wait for query execution to complete"""
-    print(f"Waiting for execution {execution_id} to complete...")
-    
-    for attempt in range(1, max_attempts + 1):
-        status_data = get_execution_status(execution_id)
-        
-        if 'error' in status_data:
-            return status_data
-            
-        state = status_data.get('state')
-        print(f"Attempt {attempt}/{max_attempts} - Status: {state}")
-        
-        if state == 'QUERY_STATE_COMPLETED':
-            return {"status": "completed"}
-        elif state in ['QUERY_STATE_FAILED', 'QUERY_STATE_CANCELLED']:
-            return {"error": f"Query execution {state.lower()}"}
-            
-        time.sleep(delay)
-    
-    return {"error": "Query execution timed out"}
-
 def get_results(execution_id):
     """Get the results of a query execution"""
-    url = f"https://api.dune.com/api/v1/execution/{execution_id}/results"
-    headers = {
-        "X-DUNE-API-KEY": API_KEY,
-        "Content-Type": "application/json"
-    }
-    
+    url = RESULTS_URL.format(execution_id=execution_id)
     try:
-        response = requests.get(url, headers=headers)
+        response = dune_request("GET", url)
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return orjson.loads(response.content)
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         error_msg = f"Error getting results for execution {execution_id}: {e}"
         if hasattr(e, 'response') and e.response is not None:
             error_msg += f" - {e.response.status_code} - {e.response.text}"
         print(error_msg)
         return {"error": error_msg}
 
+def wait_for_results(execution_id, timeout=POLL_TIMEOUT):
+    """Poll the results endpoint until the execution finishes, backing off between polls.
+
+    The results endpoint reports the execution state while the query runs
+    and includes the rows once it completes, so no separate status calls
+    are needed. 429 responses are retried inside SESSION, which waits for
+    Retry-After.
+    """
+    print(f"Waiting for execution {execution_id} to complete...")
+    
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        results = get_results(execution_id)
+        
+        if 'error' in results:
+            return results
+            
+        state = results.get('state')
+        attempt += 1
+        print(f"Attempt {attempt} - Status: {state}")
+        
+        if state == STATE_COMPLETED:
+            return results
+        elif state == STATE_COMPLETED_PARTIAL:
+            print(f"Warning: execution {execution_id} returned partial results")
+            return results
+        elif state in FAILED_STATES:
+            return {"error": f"Query execution {state.lower()}"}
+        
+        delay = backoff_delay(attempt, POLL_BASE_DELAY, POLL_MAX_DELAY)
+        if time.monotonic() + delay > deadline:
+            break
+        time.sleep(delay)
+    
+    return {"error": "Query execution timed out"}
+
 def save_results(query_id, results, results_dir):
-    """Save query results to a JSON file"""
+    """Save query results to a gzipped JSON Lines file.
+
+    The first line holds the execution info and result metadata, followed
+    by one line per result row.
+    """
     if not results or 'error' in results:
         print(f"No valid results to save for query {query_id}")
         if 'error' in results:
@@ -133,12 +200,19 @@ def save_results(query_id, results, results_dir):
     os.makedirs(results_dir, exist_ok=True)
     
     # Create a safe filename
-    results_filename = f"{query_id}_results.json"
-    results_filepath = os.path.join(results_dir, results_filename)
+    results_filename = f"{query_id}_results.jsonl.gz"
+    results_filepath = Path(results_dir) / results_filename
+    
+    result = results.get('result') or {}
+    header = {**results, 'result': {k: v for k, v in result.items() if k != 'rows'}}
     
     try:
-        with open(results_filepath, 'w', encoding='utf-8') as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+        with gzip.open(results_filepath, 'wb', compresslevel=3) as f:
+            f.write(orjson.dumps(header, option=orjson.OPT_NON_STR_KEYS))
+            f.write(b'\n')
+            for row in result.get('rows', []):
+                f.write(orjson.dumps(row, option=orjson.OPT_NON_STR_KEYS))
+                f.write(b'\n')
         print(f"Successfully saved results to: {results_filepath}")
     except Exception as e:
         print(f"Error saving results for query {query_id}: {e}")
@@ -148,43 +222,39 @@ def process_query(query_id, results_dir):
     print(f"\n{'='*50}")
     print(f"Processing query ID: {query_id}")
     
-    # Execute the query
-    execution_result = execute_query(query_id)
-    if 'error' in execution_result:
-        print(f"Failed to execute query {query_id}: {execution_result['error']}")
-        return
-    
-    execution_id = execution_result.get('execution_id')
-    if not execution_id:
-        print(f"No execution ID returned for query {query_id}")
-        return
-    
-    # Wait for completion
-    print(f"Waiting for query {query_id} to complete...")
-    completion = wait_for_completion(execution_id)
-    if 'error' in completion:
-        print(f"Query execution failed: {completion['error']}")
-        return
-    
-    # Get results
-    print(f"Fetching results for query {query_id}...")
-    results = get_results(execution_id)
-    if 'error' in results:
-        print(f"Failed to get results: {results['error']}")
-        return results
+    # Hold an execution slot only while the query runs on Dune; saving the
+    # results happens outside it so another execution can start meanwhile
+    with EXECUTION_SLOTS:
+        # Execute the query
+        execution_result = execute_query(query_id)
+        if 'error' in execution_result:
+            print(f"Failed to execute query {query_id}: {execution_result['error']}")
+            return
+        
+        execution_id = execution_result.get('execution_id')
+        if not execution_id:
+            print(f"No execution ID returned for query {query_id}")
+            return
+        
+        # Poll the results endpoint until the execution completes
+        print(f"Waiting for query {query_id} to complete...")
+        results = wait_for_results(execution_id)
+        if 'error' in results:
+            print(f"Query execution failed: {results['error']}")
+            return results
     
     # Save results
     save_results(query_id, results, results_dir)
     return results
 
 def main():
-    # Setup directories
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    results_dir = os.path.join(base_dir, 'results')
+    def run_query(query_id):
+        return process_query(query_id, RESULTS_DIR)
     
-    # Process each query
-    for query_id in query_ids:
-        process_query(query_id, results_dir)
+    # Process the queries concurrently; they share SESSION's connection pool
+    if query_ids:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(query_ids))) as executor:
+            list(executor.map(run_query, query_ids))
     
     print("\nAll queries processed!")
 